@@ -1,30 +1,276 @@
 import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 import pandas as pd
 
+# Columns stored as timestamps, per dataset
+DATETIME_COLUMNS = {
+    "orders": [
+        "order_purchase_timestamp",
+        "order_approved_at",
+        "order_delivered_carrier_date",
+        "order_delivered_customer_date",
+        "order_estimated_delivery_date",
+    ],
+    "order_items": ["shipping_limit_date"],
+    "order_reviews": ["review_creation_date", "review_answer_timestamp"],
+}
+
+# Column dtypes, per dataset, so that read_csv skips type inference:
+# low-cardinality strings are stored as categories, 5-digit zip code prefixes
+# as int32, small counts as int8 / int16 and product measures as float32
+# (they contain NaN, hence not integers).
+# Money amounts stay float64 so that sums keep their cents, and coordinates
+# stay float64 to keep distances precise
+DTYPES = {
+    "orders": {"order_status": "category"},
+    "order_items": {
+        "order_item_id": "int16",
+        "price": "float64",
+        "freight_value": "float64",
+    },
+    "order_reviews": {"review_score": "int8"},
+    "order_payments": {
+        "payment_sequential": "int16",
+        "payment_type": "category",
+        "payment_installments": "int16",
+        "payment_value": "float64",
+    },
+    "products": {
+        "product_name_lenght": "float32",
+        "product_description_lenght": "float32",
+        "product_photos_qty": "float32",
+        "product_weight_g": "float32",
+        "product_length_cm": "float32",
+        "product_height_cm": "float32",
+        "product_width_cm": "float32",
+    },
+    "customers": {
+        "customer_zip_code_prefix": "int32",
+        "customer_state": "category",
+    },
+    "sellers": {
+        "seller_zip_code_prefix": "int32",
+        "seller_state": "category",
+    },
+    "geolocation": {
+        "geolocation_zip_code_prefix": "int32",
+        "geolocation_state": "category",
+    },
+}
+
+# Key columns shared between datasets, stored as categories with identical codes.
+# Categories are the union of the column over every listed dataset, both when
+# reading csv files and when unifying Arrow dictionaries for parquet files
+SHARED_KEYS = {
+    "order_id": ["orders", "order_items", "order_reviews", "order_payments"],
+    "customer_id": ["customers", "orders"],
+}
+
+
+def _data_path(folder):
+    """
+    Returns the absolute path of a folder inside data/ (e.g. 'csv', 'parquet')
+    """
+    current_dir = os.path.dirname(__file__)
+    raw_path = os.path.join(current_dir, "../data", folder)
+    return os.path.abspath(raw_path)
+
+
+def _key_name(file_name):
+    """
+    Turns 'olist_order_items_dataset.csv' into 'order_items'
+    """
+    name = os.path.splitext(file_name)[0]
+    return name.replace("olist_", "").replace("_dataset", "")
+
+
+def convert_csv_to_parquet():
+    """
+    Converts every csv file in data/csv into a snappy-compressed parquet file in data/parquet.
+    Only needs to be run once: get_data() then reads the parquet files instead of the csv files
+    """
+    import pyarrow as pa
+    import pyarrow.csv as pv
+    import pyarrow.parquet as pq
+
+    csv_path = _data_path("csv")
+    parquet_path = _data_path("parquet")
+    os.makedirs(parquet_path, exist_ok=True)
+
+    for file in os.listdir(csv_path):
+        if not file.endswith(".csv"):
+            continue
+        column_types = {
+            column: pa.timestamp("ns")
+            for column in DATETIME_COLUMNS.get(_key_name(file), [])
+        }
+        table = pv.read_csv(
+            os.path.join(csv_path, file),
+            # review comments contain quoted line breaks
+            parse_options=pv.ParseOptions(newlines_in_values=True),
+            convert_options=pv.ConvertOptions(column_types=column_types),
+        )
+        # write to a temporary name first, so that an interrupted conversion
+        # never leaves a truncated parquet file behind
+        parquet_file = os.path.join(parquet_path, file.replace(".csv", ".parquet"))
+        pq.write_table(table, parquet_file + ".tmp", compression="snappy")
+        os.replace(parquet_file + ".tmp", parquet_file)
+
+
+def _use_parquet():
+    """
+    Returns True when data/parquet holds an up-to-date parquet file for every
+    csv file in data/csv, so that a partial conversion or a csv file modified
+    since the conversion falls back to reading the csv files
+    """
+    parquet_path = _data_path("parquet")
+    if not os.path.isdir(parquet_path):
+        return False
+    parquet_files = {
+        file for file in os.listdir(parquet_path) if file.endswith(".parquet")
+    }
+    if not parquet_files:
+        return False
+
+    csv_path = _data_path("csv")
+    csv_files = os.listdir(csv_path) if os.path.isdir(csv_path) else []
+    for file in csv_files:
+        if not file.endswith(".csv"):
+            continue
+        parquet_file = file.replace(".csv", ".parquet")
+        if parquet_file not in parquet_files:
+            return False
+        csv_mtime = os.path.getmtime(os.path.join(csv_path, file))
+        if os.path.getmtime(os.path.join(parquet_path, parquet_file)) < csv_mtime:
+            return False
+    return True
+
+
+def _share_key_categories(data):
+    """
+    Factorizes each SHARED_KEYS column once and casts it to the same
+    CategoricalDtype in every dataset, so that merges and groupbys use integer codes
+    """
+    for column, keys in SHARED_KEYS.items():
+        keys = [key for key in keys if key in data]
+        if not keys:
+            continue
+        # categories are the union of every dataset, so that no key becomes NaN
+        categories = pd.unique(pd.concat([data[key][column] for key in keys]))
+        dtype = pd.CategoricalDtype(categories=categories)
+        for key in keys:
+            data[key][column] = data[key][column].astype(dtype)
+
+
+def _share_dictionaries(tables):
+    """
+    Dictionary-encodes each SHARED_KEYS column of the Arrow tables and unifies
+    the dictionaries, so that the DataFrames share identical categories
+    """
+    import pyarrow as pa
+
+    for column, keys in SHARED_KEYS.items():
+        keys = [key for key in keys if key in tables]
+        if not keys:
+            continue
+        encoded = [tables[key][column].dictionary_encode() for key in keys]
+        unified = pa.chunked_array(
+            [chunk for array in encoded for chunk in array.chunks],
+            type=encoded[0].type,
+        ).unify_dictionaries()
+
+        # split the unified chunks back into their tables
+        start = 0
+        for key, array in zip(keys, encoded):
+            end = start + array.num_chunks
+            table = tables[key]
+            tables[key] = table.set_column(
+                table.schema.get_field_index(column),
+                column,
+                pa.chunked_array(unified.chunks[start:end], type=unified.type),
+            )
+            start = end
+
+
+def _read_csv(path):
+    """
+    Reads a single csv file into a DataFrame,
+    with datetime columns parsed as timestamps and DTYPES applied
+    """
+    key = _key_name(os.path.basename(path))
+    dtype = DTYPES.get(key, {})
+    return pd.read_csv(path, dtype=dtype, parse_dates=DATETIME_COLUMNS.get(key, False))
+
+
+def _read_parquet(path):
+    """
+    Reads a single parquet file into an Arrow table
+    """
+    import pyarrow.parquet as pq
+
+    return pq.read_table(path, use_threads=True)
+
+
+@lru_cache(maxsize=1)
+def _load_all():
+    """
+    Loads every Olist file once and keeps the result in memory,
+    so that subsequent calls to Olist().get_data() do not hit the disk again.
+    Reads data/parquet when convert_csv_to_parquet() has converted every csv file,
+    data/csv otherwise
+    """
+    if _use_parquet():
+        data_path, extension = _data_path("parquet"), ".parquet"
+    else:
+        data_path, extension = _data_path("csv"), ".csv"
+
+    file_names = [file for file in os.listdir(data_path) if file.endswith(extension)]
+    key_names = [_key_name(file) for file in file_names]
+    paths = [os.path.join(data_path, file) for file in file_names]
+
+    # pandas and pyarrow release the GIL while parsing, so files are read in parallel
+    with ThreadPoolExecutor(max_workers=max(len(paths), 1)) as executor:
+        if extension == ".parquet":
+            tables = dict(zip(key_names, executor.map(_read_parquet, paths)))
+        else:
+            data = dict(zip(key_names, executor.map(_read_csv, paths)))
+
+    if extension == ".parquet":
+        # shared keys are unified in Arrow, before converting to pandas
+        _share_dictionaries(tables)
+        data = {
+            key: table.to_pandas().astype(DTYPES.get(key, {}))
+            for key, table in tables.items()
+        }
+    else:
+        _share_key_categories(data)
+
+    # Items of the same order are contiguous, so groupbys on order_id scan runs
+    if "order_items" in data:
+        data["order_items"] = data["order_items"].sort_values(
+            "order_id", kind="stable", ignore_index=True
+        )
+
+    return data
+
 
 class Olist:
     def get_data(self):
         """
         This function returns a Python dict.
         Its keys should be 'sellers', 'orders', 'order_items' etc...
-        Its values should be pandas.DataFrames loaded from csv files
+        Its values should be pandas.DataFrames loaded from parquet files if available, csv files otherwise
+        DataFrames are loaded once and shared between calls: do not modify them inplace
+        """
+        # Return a new dict so that callers can add or drop keys safely
+        return dict(_load_all())
+
+    def reload(self):
+        """
+        Clears the cache so that the next call to get_data() reads the files again
         """
-        current_dir = os.path.dirname(__file__)
-        raw_path = os.path.join(current_dir, "../data/csv")
-        csv_path = os.path.abspath(raw_path)
-
-        file_names = list(os.listdir(csv_path))
-        key_names = [
-            file.replace(".csv", "").replace("olist_", "").replace("_dataset", "")
-            for file in file_names
-        ]
-
-        data = {}
-        for key, file in zip(key_names, file_names):
-            full_path = os.path.join(csv_path, file)
-            data[key] = pd.read_csv(full_path)
-
-        return data
+        _load_all.cache_clear()
 
     def ping(self):
         """
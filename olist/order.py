@@ -1,130 +1,156 @@
+from functools import cached_property
 import pandas as pd
 import numpy as np
-from olist.utils import haversine_distance
+from olist.utils import haversine_vectorized
 from olist.data import Olist
 
+NS_PER_DAY = 86_400_000_000_000
+
 
 class Order:
     """
     DataFrames containing all orders as index,
-    and various properties of these orders as columns
+    and various properties of these orders as columns.
+    Each DataFrame is computed once per instance: create a new Order() to recompute them
     """
 
     def __init__(self):
         # Assign an attribute ".data" to all new instances of Order
         self.data = Olist().get_data()
 
-    def get_wait_time(self, is_delivered=True):
+    @cached_property
+    def _wait_time(self):
         """
-        Returns a DataFrame with:
+        DataFrame with:
         [order_id, wait_time, expected_wait_time, delay_vs_expected, order_status]
-        and filters out non-delivered orders unless specified
+        for all orders, computed once per Order instance.
+        Day deltas are NaN for orders missing one of the dates (e.g. not yet delivered)
         """
-        orders = self.data["orders"].copy()
+        orders = self.data["orders"]
 
-        # filter
-        if is_delivered:
-            orders = orders.query("order_status == 'delivered'").copy()
-
-        # convert to datetime
-        datetime_columns = [
-            "order_purchase_timestamp",
-            "order_approved_at",
-            "order_delivered_carrier_date",
-            "order_delivered_customer_date",
-            "order_estimated_delivery_date",
-        ]
-        orders.loc[:, datetime_columns] = orders[datetime_columns].apply(pd.to_datetime)
-
-        # set variables
+        # set variables (datetime columns are parsed by Olist().get_data())
         purchase_date = orders["order_purchase_timestamp"]
         delivery_date = orders["order_delivered_customer_date"]
         expected_delivery_date = orders["order_estimated_delivery_date"]
 
-        # utility function
+        # utility function: subtract timestamps as int64 nanoseconds, NaT gives NaN
         def calc_day_delta(series1, series2):
-            return (series1 - series2) / pd.Timedelta(days=1)
+            dates1 = series1.to_numpy("datetime64[ns]")
+            dates2 = series2.to_numpy("datetime64[ns]")
+            days = (dates1.view("i8") - dates2.view("i8")) * (1.0 / NS_PER_DAY)
+            days[np.isnat(dates1) | np.isnat(dates2)] = np.nan
+            return days
 
         # calculate wait times
-        orders.loc[:, "wait_time"] = calc_day_delta(delivery_date, purchase_date)
-        orders.loc[:, "expected_wait_time"] = calc_day_delta(
-            expected_delivery_date, purchase_date
+        wait_time = calc_day_delta(delivery_date, purchase_date)
+        expected_wait_time = calc_day_delta(expected_delivery_date, purchase_date)
+
+        # compare: wait_time - expected_wait_time is delivery - expected delivery
+        delay_vs_expected = calc_day_delta(delivery_date, expected_delivery_date)
+        np.maximum(delay_vs_expected, 0, out=delay_vs_expected)
+
+        # build the result from columns rather than copying orders
+        return pd.DataFrame(
+            {
+                "order_id": orders["order_id"],
+                "wait_time": wait_time,
+                "expected_wait_time": expected_wait_time,
+                "delay_vs_expected": delay_vs_expected,
+                "order_status": orders["order_status"],
+            }
         )
 
-        # compare
-        wait_time = orders["wait_time"]
-        expected_wait_time = orders["expected_wait_time"]
-        orders.loc[:, "delay_vs_expected"] = np.maximum(
-            wait_time - expected_wait_time, 0
-        )
+    def get_wait_time(self, is_delivered=True):
+        """
+        Returns a DataFrame with:
+        [order_id, wait_time, expected_wait_time, delay_vs_expected, order_status]
+        and filters out non-delivered orders unless specified
+        """
+        wait_time = self._wait_time
+        if is_delivered:
+            return wait_time[wait_time["order_status"] == "delivered"]
+        # deep copy, so that callers cannot alter the cached DataFrame
+        return wait_time.copy()
 
-        # return columns
-        return orders[
-            [
-                "order_id",
-                "wait_time",
-                "expected_wait_time",
-                "delay_vs_expected",
-                "order_status",
-            ]
-        ]
+    @cached_property
+    def _review_score(self):
+        """
+        DataFrame with:
+        order_id, dim_is_five_star, dim_is_one_star, review_score
+        computed once per Order instance
+        """
+        reviews = self.data["order_reviews"]
+        review_score = reviews["review_score"].to_numpy()
+
+        # int8 flags, built directly from the boolean masks
+        return pd.DataFrame(
+            {
+                "order_id": reviews["order_id"],
+                "dim_is_five_star": (review_score == 5).view(np.int8),
+                "dim_is_one_star": (review_score == 1).view(np.int8),
+                "review_score": review_score,
+            }
+        )
 
     def get_review_score(self):
         """
         Returns a DataFrame with:
         order_id, dim_is_five_star, dim_is_one_star, review_score
         """
-        reviews = self.data["order_reviews"].copy()
-        reviews.loc[:, "dim_is_five_star"] = (reviews["review_score"] == 5).astype(
-            "int"
+        return self._review_score.copy()
+
+    @cached_property
+    def _order_items_aggregates(self):
+        """
+        Returns a DataFrame indexed by order_id with:
+        number_of_items, number_of_sellers, price, freight_value
+        computed in a single groupby over order_items
+        """
+        order_items = self.data["order_items"]
+        aggregates = order_items.groupby("order_id", sort=False, observed=True).agg(
+            number_of_items=("order_item_id", "count"),
+            price=("price", "sum"),
+            freight_value=("freight_value", "sum"),
         )
-        reviews.loc[:, "dim_is_one_star"] = (reviews["review_score"] == 1).astype("int")
 
-        return reviews[
-            ["order_id", "dim_is_five_star", "dim_is_one_star", "review_score"]
-        ]
+        # count distinct (order, seller) pairs rather than a per-group nunique
+        number_of_sellers = (
+            order_items[["order_id", "seller_id"]]
+            .drop_duplicates()
+            .groupby("order_id", sort=False, observed=True)
+            .size()
+        )
+        aggregates.insert(1, "number_of_sellers", number_of_sellers)
+
+        return aggregates
 
     def get_number_items(self):
         """
         Returns a DataFrame with:
         order_id, number_of_items
         """
-        order_items = self.data["order_items"].copy()
-        number_of_items = order_items.groupby("order_id")["order_item_id"].count()
-
-        return number_of_items.reset_index().rename(
-            columns={"order_item_id": "number_of_items"}
-        )
+        return self._order_items_aggregates[["number_of_items"]].reset_index()
 
     def get_number_sellers(self):
         """
         Returns a DataFrame with:
         order_id, number_of_sellers
         """
-        order_items = self.data["order_items"].copy()
-        number_of_sellers = order_items.groupby("order_id")["seller_id"].nunique()
-
-        return number_of_sellers.reset_index().rename(
-            columns={"seller_id": "number_of_sellers"}
-        )
+        return self._order_items_aggregates[["number_of_sellers"]].reset_index()
 
     def get_price_and_freight(self):
         """
         Returns a DataFrame with:
         order_id, price, freight_value
         """
-        order_items = self.data["order_items"].copy()
-        price_and_freight = order_items.groupby("order_id")[
-            ["price", "freight_value"]
-        ].sum()
-
-        return price_and_freight.reset_index()
+        return self._order_items_aggregates[["price", "freight_value"]].reset_index()
 
-    # Optional
-    def get_distance_seller_customer(self):
+    @cached_property
+    def _distance_seller_customer(self):
         """
-        Returns a DataFrame with:
+        DataFrame with:
         order_id, distance_seller_customer
+        computed once per Order instance
         """
         # $CHALLENGIFY_BEGIN
 
@@ -137,37 +163,13 @@ class Order:
 
         # Since one zip code can map to multiple (lat, lng), take the first one
         geo = data["geolocation"]
-        geo = geo.groupby("geolocation_zip_code_prefix", as_index=False).first()
-
-        # Merge geo_location for sellers
-        sellers_mask_columns = [
-            "seller_id",
-            "seller_zip_code_prefix",
-            "geolocation_lat",
-            "geolocation_lng",
-        ]
-
-        sellers_geo = sellers.merge(
-            geo,
-            how="left",
-            left_on="seller_zip_code_prefix",
-            right_on="geolocation_zip_code_prefix",
-        )[sellers_mask_columns]
-
-        # Merge geo_location for customers
-        customers_mask_columns = [
-            "customer_id",
-            "customer_zip_code_prefix",
-            "geolocation_lat",
-            "geolocation_lng",
-        ]
-
-        customers_geo = customers.merge(
-            geo,
-            how="left",
-            left_on="customer_zip_code_prefix",
-            right_on="geolocation_zip_code_prefix",
-        )[customers_mask_columns]
+        geo = geo.drop_duplicates("geolocation_zip_code_prefix").set_index(
+            "geolocation_zip_code_prefix"
+        )
+
+        # zip code -> lat / lng lookups, shared by sellers and customers
+        lat_lookup = geo["geolocation_lat"]
+        lng_lookup = geo["geolocation_lng"]
 
         # Match customers with sellers in one table
         customers_sellers = (
@@ -176,38 +178,49 @@ class Order:
             .merge(sellers, on="seller_id")[
                 [
                     "order_id",
-                    "customer_id",
                     "customer_zip_code_prefix",
-                    "seller_id",
                     "seller_zip_code_prefix",
                 ]
             ]
         )
 
         # Add the geoloc
-        matching_geo = customers_sellers.merge(sellers_geo, on="seller_id").merge(
-            customers_geo, on="customer_id", suffixes=("_seller", "_customer")
+        seller_zip = customers_sellers["seller_zip_code_prefix"]
+        customer_zip = customers_sellers["customer_zip_code_prefix"]
+        matching_geo = pd.DataFrame(
+            {
+                "order_id": customers_sellers["order_id"],
+                "lng_seller": seller_zip.map(lng_lookup),
+                "lat_seller": seller_zip.map(lat_lookup),
+                "lng_customer": customer_zip.map(lng_lookup),
+                "lat_customer": customer_zip.map(lat_lookup),
+            }
         )
-        # Remove na()
+        # Remove zip codes missing from geolocation
         matching_geo = matching_geo.dropna()
 
-        matching_geo.loc[:, "distance_seller_customer"] = matching_geo.apply(
-            lambda row: haversine_distance(
-                row["geolocation_lng_seller"],
-                row["geolocation_lat_seller"],
-                row["geolocation_lng_customer"],
-                row["geolocation_lat_customer"],
-            ),
-            axis=1,
+        matching_geo["distance_seller_customer"] = haversine_vectorized(
+            matching_geo["lng_seller"].to_numpy(),
+            matching_geo["lat_seller"].to_numpy(),
+            matching_geo["lng_customer"].to_numpy(),
+            matching_geo["lat_customer"].to_numpy(),
         )
         # Since an order can have multiple sellers,
         # return the average of the distance per order
-        order_distance = matching_geo.groupby("order_id", as_index=False).agg(
-            {"distance_seller_customer": "mean"}
-        )
+        order_distance = matching_geo.groupby(
+            "order_id", as_index=False, sort=False, observed=True
+        ).agg({"distance_seller_customer": "mean"})
 
         return order_distance
 
+    # Optional
+    def get_distance_seller_customer(self):
+        """
+        Returns a DataFrame with:
+        order_id, distance_seller_customer
+        """
+        return self._distance_seller_customer.copy()
+
     def get_training_data(self, is_delivered=True, with_distance_seller_customer=False):
         """
         Returns a clean DataFrame (without NaN), with the all following columns:
@@ -217,25 +230,22 @@ class Order:
         'distance_seller_customer']
         """
         wait_time = self.get_wait_time(is_delivered)
-        review_score = self.get_review_score()
-        get_number_items = self.get_number_items()
-        get_number_sellers = self.get_number_sellers()
-        get_price_and_freight = self.get_price_and_freight()
-
-        training_data = wait_time
-        dfs_to_merge = [
-            review_score,
-            get_number_items,
-            get_number_sellers,
-            get_price_and_freight,
-        ]
-        for df in dfs_to_merge:
-            training_data = training_data.merge(df, on="order_id")
-
+        # filter out orders missing a date (NaN day deltas) before joining
+        wait_time = wait_time[
+            wait_time[["wait_time", "expected_wait_time"]].notna().all(axis=1)
+        ].set_index("order_id")
+        review_score = self.get_review_score().set_index("order_id")
+        # number_of_items, number_of_sellers, price and freight_value
+        order_items_aggregates = self._order_items_aggregates
+
+        dfs_to_join = [review_score, order_items_aggregates]
         if with_distance_seller_customer:
-            get_distance_seller_customer = self.get_distance_seller_customer()
-            training_data = training_data.merge(
-                get_distance_seller_customer, on="order_id"
+            dfs_to_join.append(
+                self.get_distance_seller_customer().set_index("order_id")
             )
 
-        return training_data.dropna()
+        # join every DataFrame on the order_id index in a single call
+        # no dropna() needed: NaN dates and geolocations are filtered before
+        training_data = wait_time.join(dfs_to_join, how="inner").reset_index()
+
+        return training_data
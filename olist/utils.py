@@ -1,7 +1,13 @@
 from math import radians, sin, cos, asin, sqrt
+import numpy as np
 import matplotlib.pyplot as plt
 import seaborn as sns
 
+try:
+    from numba import njit, prange
+except ImportError:  # numba is optional, haversine_vectorized falls back to numpy
+    njit = None
+
 
 def haversine_distance(lon1, lat1, lon2, lat2):
     """
@@ -15,6 +21,50 @@ def haversine_distance(lon1, lat1, lon2, lat2):
     return 2 * 6371 * asin(sqrt(a))
 
 
+if njit is not None:
+
+    @njit(parallel=True, fastmath=True, cache=True)
+    def _haversine_kernel(lon1, lat1, lon2, lat2, out):
+        """
+        Writes the haversine distance of each row into `out`, rows in parallel
+        """
+        to_rad = np.pi / 180
+        for i in prange(lon1.shape[0]):
+            rlat1 = lat1[i] * to_rad
+            rlat2 = lat2[i] * to_rad
+            dlon = (lon2[i] - lon1[i]) * to_rad
+            dlat = rlat2 - rlat1
+            a = (
+                np.sin(dlat / 2) ** 2
+                + np.cos(rlat1) * np.cos(rlat2) * np.sin(dlon / 2) ** 2
+            )
+            out[i] = 2 * 6371 * np.arcsin(np.sqrt(a))
+
+else:
+    _haversine_kernel = None
+
+
+def haversine_vectorized(lon1, lat1, lon2, lat2):
+    """
+    Same as haversine_distance, but takes arrays of coordinates
+    and returns an array of distances (in km).
+    Uses a parallel numba kernel when numba is installed
+    """
+    if _haversine_kernel is not None:
+        lon1, lat1, lon2, lat2 = (
+            np.ascontiguousarray(x, dtype=np.float64) for x in (lon1, lat1, lon2, lat2)
+        )
+        out = np.empty(lon1.shape[0])
+        _haversine_kernel(lon1, lat1, lon2, lat2, out)
+        return out
+
+    lon1, lat1, lon2, lat2 = map(np.radians, [lon1, lat1, lon2, lat2])
+    dlon = lon2 - lon1
+    dlat = lat2 - lat1
+    a = np.sin(dlat / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin(dlon / 2) ** 2
+    return 2 * 6371 * np.arcsin(np.sqrt(a))
+
+
 def return_significative_coef(model):
     """
     Returns p_value, lower and upper bound coefficients